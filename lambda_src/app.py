@@ -2,17 +2,21 @@ import os
 import json
 import logging
 import base64
-import random
-import string
+import secrets
 import time
 import re
+import threading
 from decimal import Decimal
 from datetime import datetime, timedelta, date
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 import boto3
 from boto3.dynamodb.conditions import Key
-import urllib.request
-import urllib.parse
+from boto3.dynamodb.types import TypeSerializer
+from botocore.config import Config
+from botocore.exceptions import ClientError
+import urllib3
 from zoneinfo import ZoneInfo
 
 # ======================================================
@@ -24,9 +28,45 @@ logger.setLevel(logging.INFO)
 # ======================================================
 # AWS clients (boto3)
 # ======================================================
-ssm = boto3.client("ssm")
-dynamodb = boto3.resource("dynamodb")
-location = boto3.client("location")
+# Shared config: TCP keep-alive, enough pooled connections for the worker
+# threads, adaptive retries to smooth throttling
+_BOTO_CFG = Config(
+    max_pool_connections=10,
+    retries={"mode": "adaptive", "max_attempts": 5},
+    tcp_keepalive=True,
+)
+dynamodb = boto3.resource("dynamodb", config=_BOTO_CFG)
+
+# Branch-specific clients are built on first use: the webhook only needs SQS,
+# and the worker never touches SQS. The lock matters because boto3 client
+# creation is not thread-safe and geocoding runs on worker threads.
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def aws_client(name):
+    client = _CLIENTS.get(name)
+    if client is None:
+        with _CLIENTS_LOCK:
+            client = _CLIENTS.get(name)
+            if client is None:
+                client = _CLIENTS[name] = boto3.client(name, config=_BOTO_CFG)
+    return client
+
+# ======================================================
+# Worker pool for concurrent I/O (kept warm across invocations)
+# ======================================================
+# Sized to match the Telegram connection pool so broadcast threads never
+# wait on, or discard, a keep-alive connection
+_EXEC = ThreadPoolExecutor(max_workers=8)
+
+# Keep-alive HTTPS pool for Telegram (reuses TLS sessions in a warm container).
+# No automatic retries: a timed-out POST may already have been applied, and
+# resending it would duplicate the message. Stale sockets are handled in
+# tg_request_raw. Two slow calls still fit in the worker's 30 s timeout.
+_TG_POOL = urllib3.HTTPSConnectionPool(
+    "api.telegram.org", maxsize=8, retries=False,
+    timeout=urllib3.Timeout(connect=3.0, read=10.0))
 
 # ======================================================
 # Environment variables
@@ -36,6 +76,11 @@ PLACE_INDEX_NAME = os.environ["PLACE_INDEX_NAME"]
 ROUTE_CALCULATOR_NAME = os.environ["ROUTE_CALCULATOR_NAME"]
 TZ = ZoneInfo(os.environ.get("TIMEZONE", "America/Chicago"))
 DAYS_AHEAD = int(os.environ.get("PICKER_DAYS_AHEAD", "5"))
+DRIVER_CACHE_TTL = int(os.environ.get("DRIVER_CACHE_TTL", "300"))
+SESSION_TTL = int(os.environ.get("SESSION_TTL_SECONDS", "3600"))
+GEO_CACHE_TTL = int(os.environ.get("GEO_CACHE_TTL_SECONDS", str(30 * 86400)))
+# When set, the webhook only enqueues updates; worker_handler processes them
+UPDATES_QUEUE_URL = os.environ.get("UPDATES_QUEUE_URL", "")
 
 # Fare config
 FARE_BASE = float(os.environ.get("FARE_BASE", "3.00"))
@@ -59,72 +104,129 @@ DEFAULT_DRIVER_PROFILES = {
     "7964155471": {"name": "Amal Mansimov", "car": "Kia Carnival"},
 }
 
+UNKNOWN_DRIVER = ("Driver", "Car")  # (name, car) when no profile exists
+
 # ======================================================
 # Secrets cache
 # ======================================================
 _TELEGRAM_TOKEN = None
-_DRIVER_CHAT_IDS = None          # list[str]
-_DRIVER_PROFILES = None          # dict[str, {"name": "...", "car": "..."}]
+_DRIVER_ROSTER = None            # tuple[(chat_id, name, car), ...]
+_DRIVER_BY_ID = None             # dict[str, (name, car)]
+_DRIVERS_LOADED_AT = 0.0         # time.time() of last driver refresh
+
+
+_TOKEN_PARAM = "/ridebot/telegram_bot_token"
+_DRIVER_IDS_PARAM = "/ridebot/driver_chat_ids"
+_DRIVER_PROFILES_PARAM = "/ridebot/driver_profiles"
+
 
+def _get_secrets(names):
+    """Fetch several SSM parameters in one call (SecureStrings decrypted)."""
+    resp = aws_client("ssm").get_parameters(Names=list(names), WithDecryption=True)
+    if resp.get("InvalidParameters"):
+        logger.warning(f"missing SSM parameters: {resp['InvalidParameters']}")
+    return {p["Name"]: p["Value"] for p in resp.get("Parameters", [])}
 
-def _get_secret(name, decrypt=True):
-    """Fetch single SSM parameter by name (optionally decrypt SecureString)."""
-    return ssm.get_parameter(Name=name, WithDecryption=decrypt)["Parameter"]["Value"]
+
+def _set_drivers(vals):
+    """Rebuild driver caches from SSM values, merged with DEFAULT_*."""
+    global _DRIVER_ROSTER, _DRIVER_BY_ID
+    global _DRIVERS_LOADED_AT
+    raw = vals.get(_DRIVER_IDS_PARAM, "")
+    ids = [x.strip() for x in raw.split(",") if x.strip()]
+    # merge defaults (no duplicates)
+    for did in DEFAULT_DRIVER_CHAT_IDS:
+        if did not in ids:
+            ids.append(did)
+
+    try:
+        prof_raw = vals.get(_DRIVER_PROFILES_PARAM, "")
+        loaded = json.loads(prof_raw) if prof_raw.strip() else {}
+        # keys normalized to str once, so lookups by chat id never call str()
+        profiles = {str(k): v for k, v in loaded.items()}
+    except Exception:
+        profiles = {}
+    # merge defaults (defaults do not override existing)
+    for did, prof in DEFAULT_DRIVER_PROFILES.items():
+        profiles.setdefault(did, prof)
+
+    # resolve names/cars once so broadcast and accept skip per-call lookups
+    by_id = {k: (v.get("name", "Driver"), v.get("car", "Car"))
+             for k, v in profiles.items()}
+    _DRIVER_ROSTER = tuple((cid,) + by_id.get(cid, UNKNOWN_DRIVER) for cid in ids)
+    _DRIVER_BY_ID = by_id
+    _DRIVERS_LOADED_AT = time.time()
 
 
 def ensure_secrets():
     """
-    Load Telegram token, driver chat IDs, and driver profiles from SSM.
-    Then merge with DEFAULT_* so the two new drivers are always present.
+    Load Telegram token, driver chat IDs, and driver profiles from SSM
+    (one GetParameters round-trip). The token is cached for the container's
+    lifetime; driver data is refreshed every DRIVER_CACHE_TTL seconds.
+    Driver lists are merged with DEFAULT_* so the two new drivers are always present.
     """
-    global _TELEGRAM_TOKEN, _DRIVER_CHAT_IDS, _DRIVER_PROFILES
-    if _TELEGRAM_TOKEN is None:
-        _TELEGRAM_TOKEN = _get_secret("/ridebot/telegram_bot_token", True)
+    global _TELEGRAM_TOKEN, _DRIVERS_LOADED_AT
+    stale = time.time() - _DRIVERS_LOADED_AT > DRIVER_CACHE_TTL
+    if _TELEGRAM_TOKEN is not None and not stale:
+        return
 
-    if _DRIVER_CHAT_IDS is None:
-        try:
-            raw = _get_secret("/ridebot/driver_chat_ids", False)
-            _DRIVER_CHAT_IDS = [x.strip() for x in raw.split(",") if x.strip()]
-        except Exception:
-            _DRIVER_CHAT_IDS = []
-        # merge defaults (no duplicates)
-        for did in DEFAULT_DRIVER_CHAT_IDS:
-            if did not in _DRIVER_CHAT_IDS:
-                _DRIVER_CHAT_IDS.append(did)
+    names = [_DRIVER_IDS_PARAM, _DRIVER_PROFILES_PARAM]
+    if _TELEGRAM_TOKEN is None:
+        names.append(_TOKEN_PARAM)
+    try:
+        vals = _get_secrets(names)
+    except Exception:
+        if _TELEGRAM_TOKEN is None or _DRIVER_ROSTER is None:
+            raise
+        # refresh only: keep serving cached drivers, retry after another TTL
+        logger.exception("driver refresh failed, keeping cached values")
+        _DRIVERS_LOADED_AT = time.time()
+        return
 
-    if _DRIVER_PROFILES is None:
-        try:
-            prof_raw = _get_secret("/ridebot/driver_profiles", False)
-            _DRIVER_PROFILES = json.loads(prof_raw) if prof_raw.strip() else {}
-        except Exception:
-            _DRIVER_PROFILES = {}
-        # merge defaults (defaults do not override existing)
-        for did, prof in DEFAULT_DRIVER_PROFILES.items():
-            _DRIVER_PROFILES.setdefault(did, prof)
+    if _TELEGRAM_TOKEN is None:
+        if _TOKEN_PARAM not in vals:
+            raise RuntimeError(f"SSM parameter {_TOKEN_PARAM} not found")
+        _TELEGRAM_TOKEN = vals[_TOKEN_PARAM]
+    _set_drivers(vals)
 
 
 # ======================================================
 # DynamoDB table handle
 # ======================================================
 table = dynamodb.Table(TABLE_NAME)
+_SERIALIZER = TypeSerializer()
+
+# Load secrets during the Lambda INIT phase so the first request skips SSM.
+# On failure the lazy ensure_secrets() calls below retry per request.
+# The enqueue-only webhook never talks to Telegram, so it skips this.
+if not UPDATES_QUEUE_URL:
+    try:
+        ensure_secrets()
+    except Exception:
+        logger.exception("ssm init failed")
 
 # ======================================================
 # Utilities
 # ======================================================
 
 
-def ddb_decimalize(obj):
-    if isinstance(obj, float):
-        return Decimal(str(obj))
-    if isinstance(obj, dict):
-        return {k: ddb_decimalize(v) for k, v in obj.items()}
-    if isinstance(obj, list):
-        return [ddb_decimalize(v) for v in obj]
-    return obj
+def ddb_point(p):
+    """Geocode result {label, lon, lat} -> DynamoDB map (no generic walk)."""
+    return {"label": p["label"],
+            "lon": Decimal(repr(p["lon"])), "lat": Decimal(repr(p["lat"]))}
+
+
+def ddb_marshal(item):
+    """Python dict -> low-level DynamoDB attribute map for aws_client("dynamodb").
+
+    Not for dynamodb.meta.client: the resource registers its own serializer
+    on that client, so pre-marshalled items would be marshalled twice.
+    """
+    return {k: _SERIALIZER.serialize(v) for k, v in item.items()}
 
 
 def now_ts() -> int:
-    return int(datetime.now(TZ).timestamp())
+    return int(time.time())
 
 
 def round_to_15m(dt: datetime) -> datetime:
@@ -136,26 +238,44 @@ def round_to_15m(dt: datetime) -> datetime:
     return dt
 
 
+def round_epoch_15m(epoch: int) -> int:
+    # Same rounding as round_to_15m (seconds dropped, minutes rounded up),
+    # done on integers; assumes TZ offsets are whole quarter-hours.
+    return (int(epoch) // 60 + 14) // 15 * 900
+
+
+def _hm_label(hour: int, minute: int) -> str:
+    # manual "h:MM AM/PM" — avoids strftime's locale handling
+    return f"{(hour % 12) or 12}:{minute:02d} {'AM' if hour < 12 else 'PM'}"
+
+
 def fmt_ampm(dt: datetime) -> str:
-    return dt.astimezone(TZ).strftime("%I:%M %p").lstrip("0")
+    dt = dt.astimezone(TZ)
+    return _hm_label(dt.hour, dt.minute)
 
 
+@lru_cache(maxsize=512)  # pure in epoch; skips repeated zoneinfo conversions
 def fmt_epoch_ampm(epoch: int) -> str:
     return fmt_ampm(datetime.fromtimestamp(int(epoch), TZ))
 
 
+PHONE_JUNK = re.compile(r"[^\d+]")
+# group 1: already E.164; group 2: US number with optional leading 1
+PHONE_RE = re.compile(r"(\+\d{8,15})|1?(\d{10})")
+
+
 def normalize_phone(text):
     if not text:
         return None
-    digits = re.sub(r"[^\d+]", "", text.strip())
-    if digits.startswith("+") and re.fullmatch(r"\+\d{8,15}", digits):
-        return digits
-    only = re.sub(r"\D", "", digits)
-    if re.fullmatch(r"\d{10}", only):
-        return "+1" + only
-    if re.fullmatch(r"1\d{10}", only):
-        return "+" + only
-    return None
+    # keep only digits and "+", whatever the separators were
+    digits = PHONE_JUNK.sub("", text)
+    m = PHONE_RE.fullmatch(digits)
+    if not m and "+" in digits:
+        # stray "+" (e.g. "8+505551234"): retry as a bare US number
+        m = PHONE_RE.fullmatch(digits.replace("+", ""))
+    if not m:
+        return None
+    return m[1] or "+1" + m[2]
 
 
 DATE_YMD = re.compile(r"^(\d{4})-(\d{2})-(\d{2})$")
@@ -163,6 +283,14 @@ DATE_MDY = re.compile(r"^(\d{1,2})/(\d{1,2})/(\d{4})$")
 TIME_HM_24 = re.compile(r"^(\d{1,2}):(\d{2})$")
 TIME_HM_AMPM = re.compile(
     r"^(\d{1,2})(?::(\d{2}))?\s*([ap]\.?m\.?)$", re.IGNORECASE)
+TIME_H_AMPM = re.compile(r"^(\d{1,2})([ap]m)$")
+STATE_TRIP = re.compile(r"^(await_phone|await_when):(.+)$")
+WHEN_RELATIVE = re.compile(
+    r"^(today|tomorrow)\s+(\d{1,2})(?::(\d{2}))?\s*([ap]\.?m\.?)$", re.IGNORECASE)
+WHEN_YMD = re.compile(
+    r"^(\d{4})-(\d{2})-(\d{2})\s+(\d{1,2})(?::(\d{2}))?\s*([ap]\.?m\.?)$", re.IGNORECASE)
+WHEN_MDY = re.compile(
+    r"^(\d{1,2})/(\d{1,2})/(\d{4})\s+(\d{1,2})(?::(\d{2}))?\s*([ap]\.?m\.?)$", re.IGNORECASE)
 
 
 def _to_24h(h, m, ampm):
@@ -186,8 +314,7 @@ def parse_when(text):
         dt = round_to_15m(dt)
         return dt.strftime("%Y-%m-%d %H:%M"), int(dt.timestamp())
 
-    m = re.match(
-        r"^(today|tomorrow)\s+(\d{1,2})(?::(\d{2}))?\s*([ap]\.?m\.?)$", t, re.IGNORECASE)
+    m = WHEN_RELATIVE.match(t)
     if m:
         base = now_local.date() if m.group(1).lower() == "today" else (
             now_local + timedelta(days=1)).date()
@@ -198,8 +325,7 @@ def parse_when(text):
         except:
             return (None, None)
 
-    m = re.match(
-        r"^(\d{4})-(\d{2})-(\d{2})\s+(\d{1,2})(?::(\d{2}))?\s*([ap]\.?m\.?)$", t, re.IGNORECASE)
+    m = WHEN_YMD.match(t)
     if m:
         h24, m24 = _to_24h(m.group(4), m.group(5) or "00", m.group(6))
         try:
@@ -207,8 +333,7 @@ def parse_when(text):
         except:
             return (None, None)
 
-    m = re.match(
-        r"^(\d{1,2})/(\d{1,2})/(\d{4})\s+(\d{1,2})(?::(\d{2}))?\s*([ap]\.?m\.?)$", t, re.IGNORECASE)
+    m = WHEN_MDY.match(t)
     if m:
         h24, m24 = _to_24h(m.group(4), m.group(5) or "00", m.group(6))
         try:
@@ -239,7 +364,7 @@ def parse_date_only(text):
 
 def parse_time_only(text):
     t = text.strip().lower().replace(" ", "")
-    m = re.match(r"^(\d{1,2})([ap]m)$", t)
+    m = TIME_H_AMPM.match(t)
     if m:
         h24, m24 = _to_24h(m.group(1), 0, m.group(2))
         return h24, m24
@@ -275,48 +400,84 @@ def build_date_buttons(trip_id, days_ahead=DAYS_AHEAD):
     return rows
 
 
-def build_time_buttons(trip_id, y, m, d):
-    rows = []
-    start = datetime(y, m, d, 6, 0, tzinfo=TZ)
-    end = datetime(y, m, d, 23, 59, tzinfo=TZ)
-    cur = start
-    while cur <= end:
-        label = fmt_ampm(cur)
-        epoch = int(cur.timestamp())
-        rows.append(
-            [{"text": label, "callback_data": f"timepick:{trip_id}:{epoch}"}])
-        cur += timedelta(minutes=30)
-    if not rows:
-        rows.append(
-            [{"text": "No times available", "callback_data": f"datesel:{trip_id}"}])
-    return rows
+# (label, seconds after 06:00) for the 36 half-hour slots 06:00 .. 23:30.
+# Offsets are from 06:00 local, after any DST shift, so they stay exact.
+_SLOT_TABLE = tuple(
+    (_hm_label(h, mm), (h - 6) * 3600 + mm * 60)
+    for h in range(6, 24) for mm in (0, 30))
+
+
+def build_time_buttons(trip_id, day):
+    base = int(datetime(day.year, day.month, day.day, 6, 0, tzinfo=TZ).timestamp())
+    return [
+        [{"text": label, "callback_data": f"timepick:{trip_id}:{base + off}"}]
+        for label, off in _SLOT_TABLE
+    ]
+
+
+def confirm_buttons(trip_id, meta):
+    return [[{"text": f"Confirm {trip_fare_label(meta)}",
+              "callback_data": f"confirm:{trip_id}"}]]
 
 # ======================================================
 # Telegram API helpers
 # ======================================================
+_EMPTY_KB = {"inline_keyboard": []}
+# Built once: json.dumps with non-default options makes a new encoder per call
+_TG_JSON = json.JSONEncoder(separators=(",", ":"))
+
+
+class TelegramError(Exception):
+    """Bot API returned an HTTP error; description is Telegram's own text."""
+
+    def __init__(self, method, status, description):
+        super().__init__(f"Telegram {method} failed: {status} {description}")
+        self.status = status
+        self.description = description
 
 
 def tg_request(method, fields):
-    ensure_secrets()
-    url = f"https://api.telegram.org/bot{_TELEGRAM_TOKEN}/{method}"
-    data = urllib.parse.urlencode(fields).encode("utf-8")
-    req = urllib.request.Request(url, data=data, headers={
-                                 "Content-Type": "application/x-www-form-urlencoded"})
-    with urllib.request.urlopen(req, timeout=15) as resp:
-        raw = resp.read().decode("utf-8")
+    # JSON body: reply_markup and other nested fields are serialized once here
+    return tg_request_raw(method, _TG_JSON.encode(fields))
+
+
+def tg_request_raw(method, body_json):
+    """POST an already-serialized JSON body to the Bot API."""
+    # token only: the driver TTL refresh belongs to the roster readers
+    if _TELEGRAM_TOKEN is None:
+        ensure_secrets()
+    url = f"/bot{_TELEGRAM_TOKEN}/{method}"
+    body = body_json.encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    try:
+        resp = _TG_POOL.request("POST", url, body=body, headers=headers)
+    except urllib3.exceptions.ProtocolError as e:
+        # pooled socket was closed by Telegram while the container was frozen;
+        # resend once on a fresh connection (timeouts are not retried)
+        logger.warning(f"Telegram {method} connection dropped, resending: {e}")
+        resp = _TG_POOL.request("POST", url, body=body, headers=headers)
+    if resp.status >= 400:
+        # keep urlopen semantics: callers fall back on HTTP errors
         try:
-            return json.loads(raw)
-        except:
-            return {"ok": True}
+            description = json.loads(resp.data).get("description", "")
+        except Exception:
+            description = resp.data[:200].decode("utf-8", "replace")
+        raise TelegramError(method, resp.status, description)
+    try:
+        return json.loads(resp.data)
+    except:
+        return {"ok": True}
 
 
 def tg_send_message(chat_id, text, buttons=None, reply_kb=None):
     payload = {"chat_id": str(chat_id), "text": text}
     if buttons:
-        payload["reply_markup"] = json.dumps({"inline_keyboard": buttons})
-    if reply_kb:
-        payload["reply_markup"] = json.dumps(
-            {"keyboard": reply_kb, "resize_keyboard": True, "one_time_keyboard": False})
+        payload["reply_markup"] = {"inline_keyboard": buttons}
+    if reply_kb is MAIN_MENU:
+        payload["reply_markup"] = _MAIN_KB
+    elif reply_kb:
+        payload["reply_markup"] = {
+            "keyboard": reply_kb, "resize_keyboard": True, "one_time_keyboard": False}
     return tg_request("sendMessage", payload)
 
 
@@ -324,16 +485,33 @@ def tg_edit_text(chat_id, message_id, text, clear_keyboard=False):
     payload = {"chat_id": str(chat_id), "message_id": int(
         message_id), "text": text}
     if clear_keyboard:
-        payload["reply_markup"] = json.dumps({"inline_keyboard": []})
-    return tg_request("editMessageText", payload)
+        payload["reply_markup"] = _EMPTY_KB
+    try:
+        return tg_request("editMessageText", payload)
+    except TelegramError as e:
+        # double tap: text and (cleared) keyboard are already in place, so
+        # skip the caller's editMessageReplyMarkup fallback round-trip
+        if "message is not modified" in e.description:
+            return {"ok": True}
+        raise
 
 
 def tg_edit_reply_markup_clear(chat_id, message_id):
     payload = {"chat_id": str(chat_id), "message_id": int(
-        message_id), "reply_markup": json.dumps({"inline_keyboard": []})}
+        message_id), "reply_markup": _EMPTY_KB}
     return tg_request("editMessageReplyMarkup", payload)
 
 
+def tg_safe_edit(chat_id, message_id, text):
+    """Replace a callback message's text and keyboard; if the edit fails,
+    at least drop the keyboard so it cannot be tapped again."""
+    try:
+        return tg_edit_text(chat_id, message_id, text, clear_keyboard=True)
+    except Exception as e:
+        logger.warning(f"edit message failed: {e}")
+        return tg_edit_reply_markup_clear(chat_id, message_id)
+
+
 def tg_set_commands():
     cmds = [
         {"command": "start", "description": "Open menu"},
@@ -342,7 +520,22 @@ def tg_set_commands():
         {"command": "mytrips", "description": "Show recent trips"},
         {"command": "help", "description": "How it works"},
     ]
-    return tg_request("setMyCommands", {"commands": json.dumps(cmds)})
+    return tg_request("setMyCommands", {"commands": cmds})
+
+
+_CMDS_SET = False
+
+
+def _set_commands_once():
+    """Register bot commands once per container; Telegram persists them."""
+    global _CMDS_SET
+    if _CMDS_SET:
+        return
+    try:
+        tg_set_commands()
+        _CMDS_SET = True
+    except Exception:
+        logger.exception("setMyCommands failed")
 
 # ======================================================
 # Amazon Location + Fare
@@ -358,30 +551,80 @@ def calc_fare(miles, minutes):
     return round(fare, 2)
 
 
-def geocode_once(text):
+def _norm_addr(text):
+    return " ".join(text.strip().lower().split())
+
+
+def _geo_ddb_get(key):
+    """Second-tier geocode cache shared by all containers (GEO#<address> items)."""
+    # plain client: this runs on _EXEC worker threads
     try:
-        def _search(q):
-            return location.search_place_index_for_text(
-                IndexName=PLACE_INDEX_NAME, Text=q, MaxResults=1, FilterCountries=["USA"], Language="en"
-            )
-        r = _search(text)
+        item = aws_client("dynamodb").get_item(
+            TableName=TABLE_NAME,
+            Key={"pk": {"S": f"GEO#{key}"}, "sk": {"S": "GEO"}}).get("Item")
+    except Exception as e:
+        logger.warning(f"geo cache read failed: {e}")
+        return None
+    # TTL deletion is lazy; ignore entries that are already past their ttl
+    if not item or 0 < int((item.get("ttl") or {}).get("N", 0)) < now_ts():
+        return None
+    return item["label"]["S"], float(item["lon"]["N"]), float(item["lat"]["N"])
+
+
+def _geo_ddb_put(key, hit):
+    label, lon, lat = hit
+    try:
+        aws_client("dynamodb").put_item(TableName=TABLE_NAME, Item=ddb_marshal({
+            "pk": f"GEO#{key}", "sk": "GEO", "label": label,
+            "lon": Decimal(repr(lon)), "lat": Decimal(repr(lat)),
+            "ttl": now_ts() + GEO_CACHE_TTL
+        }))
+    except Exception as e:
+        logger.warning(f"geo cache write failed: {e}")
+
+
+@lru_cache(maxsize=512)
+def _geocode_cached(text):
+    # Tier 1 is this lru_cache (warm container), tier 2 is DynamoDB.
+    # Errors propagate (and are not cached); "not found" is cached as None
+    # in memory only.
+    hit = _geo_ddb_get(text)
+    if hit:
+        return hit
+
+    def _search(q):
+        return aws_client("location").search_place_index_for_text(
+            IndexName=PLACE_INDEX_NAME, Text=q, MaxResults=1, FilterCountries=["USA"], Language="en"
+        )
+    r = _search(text)
+    results = r.get("Results", [])
+    if not results:
+        r = _search(f"{text}, FL, USA")
         results = r.get("Results", [])
-        if not results:
-            r = _search(f"{text}, FL, USA")
-            results = r.get("Results", [])
-        if not results:
-            return None
-        p = results[0]["Place"]
-        label = p.get("Label", text)
-        lon, lat = map(float, p["Geometry"]["Point"])
-        return {"label": label, "lon": lon, "lat": lat}
+    if not results:
+        return None
+    p = results[0]["Place"]
+    label = p.get("Label", text)
+    lon, lat = map(float, p["Geometry"]["Point"])
+    _geo_ddb_put(text, (label, lon, lat))
+    return label, lon, lat
+
+
+def geocode_once(text):
+    """Geocode an address; identical (normalized) lookups are served from cache."""
+    try:
+        hit = _geocode_cached(_norm_addr(text))
     except Exception:
         return None
+    if not hit:
+        return None
+    label, lon, lat = hit
+    return {"label": label, "lon": lon, "lat": lat}
 
 
 def calc_route(dep, dest):
     try:
-        r = location.calculate_route(
+        r = aws_client("location").calculate_route(
             CalculatorName=ROUTE_CALCULATOR_NAME,
             DeparturePosition=[dep["lon"], dep["lat"]],
             DestinationPosition=[dest["lon"], dest["lat"]],
@@ -399,12 +642,19 @@ def calc_route(dep, dest):
 
 def get_session(user_id):
     resp = table.get_item(Key={"pk": f"USER#{user_id}", "sk": "SESSION"})
-    return resp.get("Item")
+    item = resp.get("Item")
+    # TTL deletion is lazy; treat expired-but-not-yet-reaped sessions as gone
+    if item and 0 < int(item.get("ttl") or 0) < now_ts():
+        return None
+    return item
 
 
 def put_session(user_id, state, data=None):
-    table.put_item(Item={"pk": f"USER#{user_id}",
-                   "sk": "SESSION", "state": state, "data": data or {}})
+    # plain client with our cached serializer (skips the resource layer)
+    # "ttl" lets DynamoDB reap abandoned sessions on its own
+    aws_client("dynamodb").put_item(TableName=TABLE_NAME, Item=ddb_marshal(
+        {"pk": f"USER#{user_id}", "sk": "SESSION", "state": state, "data": data or {},
+         "ttl": now_ts() + SESSION_TTL}))
 
 
 def clear_session(user_id):
@@ -416,9 +666,29 @@ def get_profile(user_id):
     return resp.get("Item")
 
 
+# {user_id: (profile_or_None, expires_at)}; short TTL bounds staleness
+# across containers, local writes invalidate immediately.
+_PROFILE_CACHE = {}
+PROFILE_CACHE_TTL = 60.0
+
+
+def get_profile_cached(user_id):
+    now = time.time()
+    hit = _PROFILE_CACHE.get(user_id)
+    if hit and hit[1] > now:
+        return hit[0]
+    prof = get_profile(user_id)
+    if len(_PROFILE_CACHE) > 256:
+        _PROFILE_CACHE.clear()
+    _PROFILE_CACHE[user_id] = (prof, now + PROFILE_CACHE_TTL)
+    return prof
+
+
 def set_profile_phone(user_id, phone):
-    table.put_item(Item={"pk": f"USER#{user_id}",
-                   "sk": "PROFILE", "phone": phone, "updated_at": now_ts()})
+    _PROFILE_CACHE.pop(user_id, None)
+    # plain client: safe to call from _EXEC worker threads
+    aws_client("dynamodb").put_item(TableName=TABLE_NAME, Item=ddb_marshal(
+        {"pk": f"USER#{user_id}", "sk": "PROFILE", "phone": phone, "updated_at": now_ts()}))
 
 # ======================================================
 # Trips (DynamoDB)
@@ -426,35 +696,42 @@ def set_profile_phone(user_id, phone):
 
 
 def save_trip(user_id, dep, dest, miles, minutes, fare):
-    tid = "".join(random.choices(string.ascii_lowercase + string.digits, k=6))
+    tid = secrets.token_hex(3)
     created = now_ts()
-    dep_ddb = ddb_decimalize(dep)
-    dest_ddb = ddb_decimalize(dest)
-    table.put_item(Item={
+    dep_ddb = ddb_point(dep)
+    dest_ddb = ddb_point(dest)
+    user_item = {
         "pk": f"USER#{user_id}", "sk": f"TRIP#{tid}",
         "trip_id": tid, "user_id": str(user_id),
         "dep": dep_ddb, "dest": dest_ddb,
         "miles": Decimal(str(miles)), "minutes": Decimal(str(minutes)),
         "fare": Decimal(str(fare)), "status": "await_when", "created_at": created
-    })
-    table.put_item(Item={
+    }
+    meta_item = {
         "pk": f"TRIP#{tid}", "sk": "META",
         "trip_id": tid, "user_id": str(user_id), "user_chat_id": str(user_id),
         "dep_label": dep.get("label", ""), "dest_label": dest.get("label", ""),
         "miles": Decimal(str(miles)), "minutes": Decimal(str(minutes)),
-        "fare": Decimal(str(fare)), "status": "await_when", "created_at": created
-    })
+        "fare": Decimal(str(fare)), "fare_label": f"${fare:.2f}",
+        "status": "await_when", "created_at": created
+    }
+    # both rows land atomically in a single TransactWriteItems request
+    aws_client("dynamodb").transact_write_items(TransactItems=[
+        {"Put": {"TableName": TABLE_NAME, "Item": ddb_marshal(user_item)}},
+        {"Put": {"TableName": TABLE_NAME, "Item": ddb_marshal(meta_item)}},
+    ])
     return tid
 
 
+def trip_fare_label(meta):
+    # rows written before fare_label existed fall back to formatting fare
+    return meta.get("fare_label") or f"${float(meta.get('fare', 0)):.2f}"
+
+
 def set_trip_when_epoch(trip_id, epoch):
-    dt = round_to_15m(datetime.fromtimestamp(int(epoch), TZ))
-    iso = dt.strftime("%Y-%m-%d %H:%M")
-    table.update_item(
-        Key={"pk": f"TRIP#{trip_id}", "sk": "META"},
-        UpdateExpression="SET desired_time_text=:t, desired_time_epoch=:e",
-        ExpressionAttributeValues={":t": iso, ":e": int(dt.timestamp())}
-    )
+    # round on integers; only one datetime is built, for the text form
+    e = round_epoch_15m(epoch)
+    set_trip_when(trip_id, datetime.fromtimestamp(e, TZ).strftime("%Y-%m-%d %H:%M"), e)
 
 
 def set_trip_when(trip_id, when_text, when_epoch):
@@ -466,20 +743,59 @@ def set_trip_when(trip_id, when_text, when_epoch):
 
 
 def set_trip_phone(trip_id, phone_e164):
-    table.update_item(
+    """Store passenger phone; returns the updated trip meta item."""
+    resp = table.update_item(
         Key={"pk": f"TRIP#{trip_id}", "sk": "META"},
         UpdateExpression="SET passenger_phone=:p",
-        ExpressionAttributeValues={":p": phone_e164}
+        ExpressionAttributeValues={":p": phone_e164},
+        ReturnValues="ALL_NEW"
     )
+    return resp.get("Attributes")
 
 
 def set_trip_status(trip_id, user_id, status):
-    table.update_item(
-        Key={"pk": f"TRIP#{trip_id}", "sk": "META"},
-        UpdateExpression="SET #s=:s",
-        ExpressionAttributeNames={"#s": "status"},
-        ExpressionAttributeValues={":s": status}
-    )
+    # Both rows change atomically in one TransactWriteItems round-trip
+    def _update(pk, sk):
+        return {"Update": {
+            "TableName": TABLE_NAME,
+            "Key": {"pk": {"S": pk}, "sk": {"S": sk}},
+            "UpdateExpression": "SET #s=:s",
+            "ExpressionAttributeNames": {"#s": "status"},
+            "ExpressionAttributeValues": {":s": {"S": status}},
+        }}
+    aws_client("dynamodb").transact_write_items(TransactItems=[
+        _update(f"TRIP#{trip_id}", "META"),
+        _update(f"USER#{user_id}", f"TRIP#{trip_id}"),
+    ])
+
+
+def set_trip_status_if(trip_id, status, condition, values=None, fields=None):
+    """
+    Conditionally set META status (plus optional extra attributes) in one call.
+    Returns the updated meta item, or None if the condition did not hold.
+    """
+    sets = ["#s=:s"]
+    attr_values = {":s": status, **(values or {})}
+    for i, (name, value) in enumerate((fields or {}).items()):
+        sets.append(f"{name}=:f{i}")
+        attr_values[f":f{i}"] = value
+    try:
+        resp = table.update_item(
+            Key={"pk": f"TRIP#{trip_id}", "sk": "META"},
+            UpdateExpression="SET " + ", ".join(sets),
+            ConditionExpression=condition,
+            ExpressionAttributeNames={"#s": "status"},
+            ExpressionAttributeValues=attr_values,
+            ReturnValues="ALL_NEW"
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return None
+        raise
+    return resp.get("Attributes")
+
+
+def set_user_trip_status(user_id, trip_id, status):
     table.update_item(
         Key={"pk": f"USER#{user_id}", "sk": f"TRIP#{trip_id}"},
         UpdateExpression="SET #s=:s",
@@ -488,30 +804,30 @@ def set_trip_status(trip_id, user_id, status):
     )
 
 
-def set_trip_driver(trip_id, driver_id, driver_name, driver_car):
-    table.update_item(
-        Key={"pk": f"TRIP#{trip_id}", "sk": "META"},
-        UpdateExpression="SET driver_id=:d, driver_name=:n, driver_car=:c",
-        ExpressionAttributeValues={
-            ":d": str(driver_id), ":n": driver_name, ":c": driver_car}
-    )
-
-
 def get_trip_meta(trip_id):
     resp = table.get_item(Key={"pk": f"TRIP#{trip_id}", "sk": "META"})
     return resp.get("Item")
 
 
-def list_recent_trips(chat_id, user_id):
+# Rendered /mytrips text per user: {user_id: (rendered_at, text)}.
+# Absorbs rapid repeat taps without another DynamoDB query.
+_TRIPS_CACHE = {}
+TRIPS_CACHE_TTL = 5.0
+
+
+def _render_recent_trips(user_id):
     resp = table.query(
         KeyConditionExpression=Key("pk").eq(
             f"USER#{user_id}") & Key("sk").begins_with("TRIP#"),
+        # fetch only what the listing renders (skip dep/dest coordinates)
+        ProjectionExpression="trip_id, #s, miles, minutes, fare, desired_time_text, "
+                             "driver_name, driver_car, dep.#l, dest.#l",
+        ExpressionAttributeNames={"#s": "status", "#l": "label"},
         ScanIndexForward=False, Limit=5
     )
     items = resp.get("Items", [])
     if not items:
-        tg_send_message(chat_id, "You have no trips yet.")
-        return
+        return "You have no trips yet."
     lines = []
     for it in items:
         dep = it.get("dep", {}).get("label", "—")
@@ -526,24 +842,303 @@ def list_recent_trips(chat_id, user_id):
         dcar = it.get("driver_car", "")
         lines.append(
             f"#{tid}: {dep} → {dest}\n  {miles:.1f} mi • {mins} min • ${fare:.2f} • {status} • {when} • {dname} {dcar}".strip())
-    tg_send_message(chat_id, "Your recent trips:\n\n" + "\n\n".join(lines))
+    return "Your recent trips:\n\n" + "\n\n".join(lines)
+
+
+def list_recent_trips(chat_id, user_id):
+    now = time.time()
+    ts, text = _TRIPS_CACHE.get(user_id, (0.0, None))
+    if text is None or now - ts >= TRIPS_CACHE_TTL:
+        text = _render_recent_trips(user_id)
+        if len(_TRIPS_CACHE) > 256:
+            _TRIPS_CACHE.clear()
+        _TRIPS_CACHE[user_id] = (now, text)
+    tg_send_message(chat_id, text)
 
 
 # ======================================================
 # Main menu
 # ======================================================
 MAIN_MENU = [["📝 New ride", "🚖 My trips"], ["⚙️ Settings", "ℹ️ Help"]]
+_MAIN_KB = {"keyboard": MAIN_MENU,
+            "resize_keyboard": True, "one_time_keyboard": False}
 
 
 def show_menu(chat_id):
     tg_send_message(chat_id, "Choose an action:", reply_kb=MAIN_MENU)
 
+# ======================================================
+# Driver notifications
+# ======================================================
+
+
+# sendMessage body for a driver; trip ids are hex and chat ids numeric, so
+# they are safe to splice in unescaped. {text} must already be JSON-encoded.
+_DRIVER_MSG_TMPL = (
+    '{{"chat_id":"{drv}","text":{text},"reply_markup":{{"inline_keyboard":['
+    '[{{"text":"Accept {tid}","callback_data":"accept:{tid}:{drv}"}}],'
+    '[{{"text":"Decline {tid}","callback_data":"decline:{tid}:{drv}"}}]]}}}}'
+)
+
+
+def notify_driver(drv, trip_id, text_json):
+    try:
+        tg_request_raw("sendMessage", _DRIVER_MSG_TMPL.format(
+            drv=drv, tid=trip_id, text=text_json))
+    except Exception:
+        logger.exception(f"notify driver {drv} failed")
+
+
+def broadcast_to_drivers(trip_id, driver_msg):
+    """Send the ride request to every driver concurrently."""
+    ensure_secrets()  # roster is loaded at init; this only refreshes when stale
+    text_json = json.dumps(driver_msg)  # encoded once for all drivers
+    list(_EXEC.map(lambda drv: notify_driver(drv[0], trip_id, text_json),
+                   _DRIVER_ROSTER))
+
+# ======================================================
+# Text commands (slash commands and main-menu buttons)
+# ======================================================
+# Every webhook/handler exit acks Telegram with the same response
+_OK = {"statusCode": 200, "body": "ok"}
+
+
+def _c_start(chat_id, user_id):
+    # put_session overwrites the whole SESSION item, no clear needed first
+    _set_commands_once()
+    tg_send_message(
+        chat_id, "Hello! I’m your ride assistant.", reply_kb=MAIN_MENU)
+    put_session(user_id, "idle", {})
+    return _OK
+
+
+def _c_newride(chat_id, user_id):
+    tg_send_message(chat_id, "Please enter the pickup address.")
+    put_session(user_id, "await_pickup", {})
+    return _OK
+
+
+def _c_mytrips(chat_id, user_id):
+    list_recent_trips(chat_id, user_id)
+    show_menu(chat_id)
+    return _OK
+
+
+def _c_help(chat_id, user_id):
+    show_menu(chat_id)
+    tg_send_message(chat_id,
+                    "Flow:\n1) Pickup & drop-off\n2) Pick date & time\n"
+                    "3) Enter phone (saved for next time)\n4) Confirm — driver will contact you via SMS."
+                    )
+    return _OK
+
+
+TEXT_COMMANDS = {
+    "/start": _c_start,
+    "/menu": _c_start,
+    "/newride": _c_newride,
+    "📝 New ride": _c_newride,
+    "/mytrips": _c_mytrips,
+    "🚖 My trips": _c_mytrips,
+    "/help": _c_help,
+    "ℹ️ Help": _c_help,
+}
+
+# ======================================================
+# Callback handlers (inline buttons)
+# Each receives the callback payload after "<op>:".
+# ======================================================
+
+
+def _h_datesel(chat_id, msg_id, rest):
+    trip_id = rest
+    kb = build_date_buttons(trip_id)
+    tg_send_message(chat_id, "Choose a date:", buttons=kb)
+    return _OK
+
+
+def _h_datepick(chat_id, msg_id, rest):
+    trip_id, iso_d = rest.split(":")
+    day = date.fromisoformat(iso_d)
+    tg_safe_edit(chat_id, msg_id, f"✅ Date: {iso_d}")
+    kb = build_time_buttons(trip_id, day)
+    tg_send_message(chat_id, f"Choose a time for {iso_d}:", buttons=kb)
+    return _OK
+
+
+def _h_timepick(chat_id, msg_id, rest):
+    trip_id, epoch = rest.split(":")
+    epoch_i = int(epoch)
+    set_trip_when_epoch(trip_id, epoch_i)
+    tg_safe_edit(chat_id, msg_id, f"✅ Time: {fmt_epoch_ampm(epoch_i)}")
+    return after_when_ask_phone_or_profile(chat_id, chat_id, trip_id)
+
+
+def _h_usephone(chat_id, msg_id, rest):
+    trip_id = rest
+    prof = get_profile_cached(chat_id) or {}
+    saved_phone = prof.get("phone")
+    if not saved_phone:
+        tg_send_message(
+            chat_id, "No saved phone found. Please enter your number.")
+        put_session(chat_id, f"await_phone:{trip_id}", {})
+        return _OK
+    meta = set_trip_phone(trip_id, saved_phone) or {}
+    when_txt = meta.get("desired_time_text", "unspecified")
+    tg_send_message(
+        chat_id,
+        f"Using saved phone: {saved_phone}\nRequested time: {when_txt}\n\n"
+        f"Ready to confirm ride #{trip_id}?",
+        buttons=confirm_buttons(trip_id, meta)
+    )
+    return _OK
+
+
+def _h_changephone(chat_id, msg_id, rest):
+    trip_id = rest
+    tg_send_message(chat_id, "Please enter your phone number.")
+    put_session(chat_id, f"await_phone:{trip_id}", {})
+    return _OK
+
+
+def _confirm_rejected(chat_id, msg_id, trip_id):
+    # Slow path: the conditional update failed, read the trip to explain why
+    meta = get_trip_meta(trip_id)
+    if not meta:
+        tg_send_message(
+            chat_id, "Something went wrong. Please start again.")
+        return _OK
+    current = meta.get("status")
+    if current in ("pending", "accepted", "declined"):
+        tg_safe_edit(chat_id, msg_id, f"ℹ️ Request #{trip_id} is already {current}.")
+        return _OK
+    if not meta.get("desired_time_text"):
+        tg_send_message(chat_id, "Please pick date & time first.")
+        return _OK
+    if not meta.get("passenger_phone"):
+        tg_send_message(
+            chat_id, "Please enter your phone number first.")
+    return _OK
+
+
+def _h_confirm(chat_id, msg_id, rest):
+    trip_id = rest
+    meta = set_trip_status_if(
+        trip_id, "pending",
+        "attribute_exists(pk) AND attribute_exists(desired_time_text) "
+        "AND attribute_exists(passenger_phone) "
+        "AND (attribute_not_exists(#s) OR NOT #s IN (:s, :a, :d))",
+        values={":a": "accepted", ":d": "declined"})
+    if meta is None:
+        return _confirm_rejected(chat_id, msg_id, trip_id)
+
+    set_user_trip_status(meta["user_id"], trip_id, "pending")
+    tg_safe_edit(
+        chat_id, msg_id,
+        f"✅ Request #{trip_id} sent to the driver.\nDriver will contact you via SMS.")
+
+    phone = meta.get("passenger_phone")
+    fare_label = trip_fare_label(meta)
+    dep = meta.get("dep_label", "")
+    dest = meta.get("dest_label", "")
+    miles = float(meta.get("miles", 0.0))
+    mins = int(float(meta.get("minutes", 0.0)))
+    when = meta.get("desired_time_text", "")
+    driver_msg = (f"🚖 New ride request #{trip_id}\n"
+                  f"Client phone: {phone}\nWhen: {when}\n"
+                  f"{dep} → {dest}\n{miles:.1f} mi • {mins} min • {fare_label}")
+    broadcast_to_drivers(trip_id, driver_msg)
+    return _OK
+
+
+def _h_accept(chat_id, msg_id, rest):
+    try:
+        trip_id, driver_id = rest.split(":")
+    except ValueError:
+        return _OK
+
+    ensure_secrets()  # roster is loaded at init; this only refreshes when stale
+    dname, dcar = _DRIVER_BY_ID.get(driver_id, UNKNOWN_DRIVER)
+    # Status and driver are claimed together, so two drivers cannot both accept
+    meta = set_trip_status_if(
+        trip_id, "accepted",
+        "attribute_exists(pk) AND (attribute_not_exists(#s) OR #s <> :s)",
+        fields={"driver_id": str(driver_id), "driver_name": dname, "driver_car": dcar})
+    if meta is None:
+        meta = get_trip_meta(trip_id)
+        if not meta:
+            tg_edit_text(
+                chat_id, msg_id, f"❌ Ride #{trip_id} not found.", clear_keyboard=True)
+            return _OK
+        taken_by = meta.get("driver_name", "another driver")
+        tg_safe_edit(chat_id, msg_id, f"ℹ️ Ride #{trip_id} already accepted by {taken_by}.")
+        return _OK
+
+    set_user_trip_status(meta["user_id"], trip_id, "accepted")
+
+    tg_safe_edit(chat_id, msg_id, f"✅ Ride #{trip_id} accepted.")
+
+    tg_send_message(
+        meta["user_chat_id"],
+        f"✅ Your request #{trip_id} has been confirmed.\nDriver: {dname}\nCar: {dcar}\n"
+        f"Driver will contact you via SMS."
+    )
+    tg_send_message(chat_id, f"✅ Client notified for ride #{trip_id}.")
+    return _OK
+
+
+def _h_decline(chat_id, msg_id, rest):
+    try:
+        trip_id, driver_id = rest.split(":")
+    except ValueError:
+        return _OK
+
+    meta = get_trip_meta(trip_id)
+    tg_safe_edit(chat_id, msg_id, f"❌ Ride #{trip_id} declined.")
+
+    if meta and meta.get("status") == "pending":
+        set_trip_status(trip_id, meta["user_id"], "declined")
+        tg_send_message(
+            meta["user_chat_id"], f"❌ Sorry, your request #{trip_id} was declined.")
+    return _OK
+
+
+CALLBACK_HANDLERS = {
+    "datesel": _h_datesel,
+    "datepick": _h_datepick,
+    "timepick": _h_timepick,
+    "usephone": _h_usephone,
+    "changephone": _h_changephone,
+    "confirm": _h_confirm,
+    "accept": _h_accept,
+    "decline": _h_decline,
+}
+
 # ======================================================
 # Lambda handler
 # ======================================================
 
 
+def _update_sender_id(update):
+    for key in ("message", "callback_query"):
+        sender = (update.get(key) or {}).get("from") or {}
+        if "id" in sender:
+            return str(sender["id"])
+    return "0"
+
+
+def enqueue_update(update, body):
+    """Queue an update for worker_handler; FIFO per sender keeps each chat in order."""
+    aws_client("sqs").send_message(
+        QueueUrl=UPDATES_QUEUE_URL,
+        MessageBody=body,
+        MessageGroupId=_update_sender_id(update),
+        MessageDeduplicationId=str(update.get("update_id", secrets.token_hex(8))),
+    )
+
+
 def lambda_handler(event, context):
+    """Telegram webhook entry: ack fast, leave the slow work to the worker."""
     try:
         body = event.get("body", "")
         if event.get("isBase64Encoded"):
@@ -551,8 +1146,37 @@ def lambda_handler(event, context):
         update = json.loads(body or "{}")
     except Exception:
         logger.exception("Failed to parse body")
-        return {"statusCode": 200, "body": "ok"}
+        return _OK
 
+    # edited_message, my_chat_member, channel_post etc. are never handled,
+    # and bot senders are ignored: ack them without queueing any work
+    if "message" in update:
+        if (update["message"].get("from") or {}).get("is_bot"):
+            return _OK
+    elif "callback_query" not in update:
+        return _OK
+
+    if UPDATES_QUEUE_URL:
+        enqueue_update(update, body or "{}")
+        return _OK
+    return process_update(update)
+
+
+def worker_handler(event, context):
+    """SQS consumer: process queued Telegram updates in order."""
+    records = event.get("Records", [])
+    for i, rec in enumerate(records):
+        try:
+            process_update(json.loads(rec["body"]))
+        except Exception:
+            logger.exception("Failed to process queued update")
+            # FIFO: retry this record and everything queued behind it
+            return {"batchItemFailures": [
+                {"itemIdentifier": r["messageId"]} for r in records[i:]]}
+    return {"batchItemFailures": []}
+
+
+def process_update(update):
     # -------- message --------
     if "message" in update:
         msg = update["message"]
@@ -560,88 +1184,65 @@ def lambda_handler(event, context):
         user_id = msg["from"]["id"]
         text = (msg.get("text") or "").strip()
 
-        if text in ("/start", "/menu"):
-            clear_session(user_id)
-            tg_set_commands()
-            tg_send_message(
-                chat_id, "Hello! I’m your ride assistant.", reply_kb=MAIN_MENU)
-            put_session(user_id, "idle", {})
-            return {"statusCode": 200, "body": "ok"}
-
-        if text in ("/newride", "📝 New ride"):
-            clear_session(user_id)
-            tg_send_message(chat_id, "Please enter the pickup address.")
-            put_session(user_id, "await_pickup", {})
-            return {"statusCode": 200, "body": "ok"}
-
-        if text in ("/mytrips", "🚖 My trips"):
-            list_recent_trips(chat_id, user_id)
-            show_menu(chat_id)
-            return {"statusCode": 200, "body": "ok"}
-
-        if text in ("/help", "ℹ️ Help"):
-            show_menu(chat_id)
-            tg_send_message(chat_id,
-                            "Flow:\n1) Pickup & drop-off\n2) Pick date & time\n"
-                            "3) Enter phone (saved for next time)\n4) Confirm — driver will contact you via SMS."
-                            )
-            return {"statusCode": 200, "body": "ok"}
+        cmd = TEXT_COMMANDS.get(text)
+        if cmd:
+            return cmd(chat_id, user_id)
 
         session = get_session(user_id) or {}
         state = session.get("state")
         sdata = session.get("data", {}) or {}
 
-        if state and isinstance(state, str) and state.startswith("await_when:"):
-            tg_send_message(chat_id, "Please use 📆 Pick date & time.")
-            return {"statusCode": 200, "body": "ok"}
+        # "<kind>:<trip_id>" states are split in one match
+        m = STATE_TRIP.match(state) if isinstance(state, str) else None
+        kind, trip_id = m.groups() if m else (None, None)
 
-        if state in ("await_time", "await_date"):
+        if kind == "await_when" or state in ("await_time", "await_date"):
             tg_send_message(chat_id, "Please use 📆 Pick date & time.")
-            return {"statusCode": 200, "body": "ok"}
+            return _OK
 
-        if state and isinstance(state, str) and state.startswith("await_phone:"):
-            trip_id = state.split(":", 1)[1]
+        if kind == "await_phone":
             phone = normalize_phone(text)
             if not phone:
                 tg_send_message(
                     chat_id, "Phone format is invalid. Please enter like +1 850 555 1234.")
-                return {"statusCode": 200, "body": "ok"}
-            set_trip_phone(trip_id, phone)
-            set_profile_phone(user_id, phone)
-            meta = get_trip_meta(trip_id) or {}
-            fare = float(meta.get("fare", 0))
+                return _OK
+            # the two rows are independent: write them concurrently; the trip
+            # update stays inline because its ALL_NEW item feeds the reply
+            fprof = _EXEC.submit(set_profile_phone, user_id, phone)
+            meta = set_trip_phone(trip_id, phone) or {}
+            fprof.result()
             when_txt = meta.get("desired_time_text", "unspecified")
             tg_send_message(
                 chat_id,
                 f"Thanks! Phone saved: {phone}\nRequested time: {when_txt}\n\n"
                 f"Ready to confirm ride #{trip_id}?",
-                buttons=[[{"text": f"Confirm ${fare:.2f}",
-                           "callback_data": f"confirm:{trip_id}"}]]
+                buttons=confirm_buttons(trip_id, meta)
             )
             clear_session(user_id)
-            return {"statusCode": 200, "body": "ok"}
+            return _OK
 
         if state == "await_pickup":
             put_session(user_id, "await_dropoff", {"pickup_raw": text})
             tg_send_message(chat_id, "Got it. Now enter the drop-off address:")
-            return {"statusCode": 200, "body": "ok"}
+            return _OK
 
         if state == "await_dropoff":
             sdata["dropoff_raw"] = text
-            dep = geocode_once(sdata["pickup_raw"])
-            dest = geocode_once(sdata["dropoff_raw"])
+            fdep = _EXEC.submit(geocode_once, sdata["pickup_raw"])
+            fdest = _EXEC.submit(geocode_once, sdata["dropoff_raw"])
+            dep, dest = fdep.result(), fdest.result()
             if not dep:
                 tg_send_message(
                     chat_id, "Could not find the pickup address. Please include street, city, and state.")
                 clear_session(user_id)
                 show_menu(chat_id)
-                return {"statusCode": 200, "body": "ok"}
+                return _OK
             if not dest:
                 tg_send_message(
                     chat_id, "Could not find the drop-off address. Please include street, city, and state.")
                 clear_session(user_id)
                 show_menu(chat_id)
-                return {"statusCode": 200, "body": "ok"}
+                return _OK
 
             distance_m, duration_s = calc_route(dep, dest)
             if not distance_m or not duration_s:
@@ -649,7 +1250,7 @@ def lambda_handler(event, context):
                     chat_id, "Could not calculate the route. Please check the addresses and try again.")
                 clear_session(user_id)
                 show_menu(chat_id)
-                return {"statusCode": 200, "body": "ok"}
+                return _OK
 
             miles = distance_m / 1609.34
             minutes = duration_s / 60.0
@@ -666,10 +1267,10 @@ def lambda_handler(event, context):
             )
             tg_send_message(chat_id, msg, buttons=buttons)
             put_session(user_id, f"await_when:{trip_id}", {})
-            return {"statusCode": 200, "body": "ok"}
+            return _OK
 
         show_menu(chat_id)
-        return {"statusCode": 200, "body": "ok"}
+        return _OK
 
     # -------- callback_query --------
     if "callback_query" in update:
@@ -677,184 +1278,12 @@ def lambda_handler(event, context):
         chat_id = cq["message"]["chat"]["id"]
         msg_id = cq["message"]["message_id"]
         data = cq.get("data", "")
-        ensure_secrets()
 
-        if data.startswith("datesel:"):
-            trip_id = data.split(":", 1)[1]
-            kb = build_date_buttons(trip_id)
-            tg_send_message(chat_id, "Choose a date:", buttons=kb)
-            return {"statusCode": 200, "body": "ok"}
-
-        if data.startswith("datepick:"):
-            _, trip_id, iso_d = data.split(":")
-            y, m, d = map(int, iso_d.split("-"))
-            try:
-                tg_edit_text(chat_id, msg_id,
-                             f"✅ Date: {iso_d}", clear_keyboard=True)
-            except Exception as e:
-                logger.warning(f"edit date keyboard failed: {e}")
-                tg_edit_reply_markup_clear(chat_id, msg_id)
-            kb = build_time_buttons(trip_id, y, m, d)
-            tg_send_message(chat_id, f"Choose a time for {iso_d}:", buttons=kb)
-            return {"statusCode": 200, "body": "ok"}
-
-        if data.startswith("timepick:"):
-            _, trip_id, epoch = data.split(":")
-            epoch_i = int(epoch)
-            set_trip_when_epoch(trip_id, epoch_i)
-            try:
-                tg_edit_text(
-                    chat_id, msg_id, f"✅ Time: {fmt_epoch_ampm(epoch_i)}", clear_keyboard=True)
-            except Exception as e:
-                logger.warning(f"edit time keyboard failed: {e}")
-                tg_edit_reply_markup_clear(chat_id, msg_id)
-            return after_when_ask_phone_or_profile(chat_id, chat_id, trip_id)
-
-        if data.startswith("usephone:"):
-            trip_id = data.split(":", 1)[1]
-            prof = get_profile(chat_id) or {}
-            saved_phone = prof.get("phone")
-            if not saved_phone:
-                tg_send_message(
-                    chat_id, "No saved phone found. Please enter your number.")
-                put_session(chat_id, f"await_phone:{trip_id}", {})
-                return {"statusCode": 200, "body": "ok"}
-            set_trip_phone(trip_id, saved_phone)
-            meta = get_trip_meta(trip_id) or {}
-            fare = float(meta.get("fare", 0))
-            when_txt = meta.get("desired_time_text", "unspecified")
-            tg_send_message(
-                chat_id,
-                f"Using saved phone: {saved_phone}\nRequested time: {when_txt}\n\n"
-                f"Ready to confirm ride #{trip_id}?",
-                buttons=[[{"text": f"Confirm ${fare:.2f}",
-                           "callback_data": f"confirm:{trip_id}"}]]
-            )
-            return {"statusCode": 200, "body": "ok"}
-
-        if data.startswith("changephone:"):
-            trip_id = data.split(":", 1)[1]
-            tg_send_message(chat_id, "Please enter your phone number.")
-            put_session(chat_id, f"await_phone:{trip_id}", {})
-            return {"statusCode": 200, "body": "ok"}
-
-        if data.startswith("confirm:"):
-            trip_id = data.split(":", 1)[1]
-            meta = get_trip_meta(trip_id)
-            if not meta:
-                tg_send_message(
-                    chat_id, "Something went wrong. Please start again.")
-                return {"statusCode": 200, "body": "ok"}
-            current = meta.get("status")
-            if current in ("pending", "accepted", "declined"):
-                try:
-                    tg_edit_text(
-                        chat_id, msg_id, f"ℹ️ Request #{trip_id} is already {current}.", clear_keyboard=True)
-                except Exception:
-                    tg_edit_reply_markup_clear(chat_id, msg_id)
-                return {"statusCode": 200, "body": "ok"}
-            if not meta.get("desired_time_text"):
-                tg_send_message(chat_id, "Please pick date & time first.")
-                return {"statusCode": 200, "body": "ok"}
-            if not meta.get("passenger_phone"):
-                tg_send_message(
-                    chat_id, "Please enter your phone number first.")
-                return {"statusCode": 200, "body": "ok"}
-
-            set_trip_status(trip_id, meta["user_id"], "pending")
-            try:
-                tg_edit_text(
-                    chat_id, msg_id,
-                    f"✅ Request #{trip_id} sent to the driver.\nDriver will contact you via SMS.",
-                    clear_keyboard=True
-                )
-            except Exception:
-                tg_edit_reply_markup_clear(chat_id, msg_id)
-
-            phone = meta.get("passenger_phone")
-            fare = float(meta.get("fare", 0))
-            dep = meta.get("dep_label", "")
-            dest = meta.get("dest_label", "")
-            miles = float(meta.get("miles", 0.0))
-            mins = int(float(meta.get("minutes", 0.0)))
-            when = meta.get("desired_time_text", "")
-            driver_msg = (f"🚖 New ride request #{trip_id}\n"
-                          f"Client phone: {phone}\nWhen: {when}\n"
-                          f"{dep} → {dest}\n{miles:.1f} mi • {mins} min • ${fare:.2f}")
-            for drv in _DRIVER_CHAT_IDS:
-                tg_send_message(
-                    drv,
-                    driver_msg,
-                    buttons=[
-                        [{"text": f"Accept {trip_id}",
-                            "callback_data": f"accept:{trip_id}:{drv}"}],
-                        [{"text": f"Decline {trip_id}",
-                            "callback_data": f"decline:{trip_id}:{drv}"}]
-                    ]
-                )
-            return {"statusCode": 200, "body": "ok"}
-
-        if data.startswith("accept:"):
-            try:
-                _, trip_id, driver_id = data.split(":")
-            except ValueError:
-                return {"statusCode": 200, "body": "ok"}
-
-            meta = get_trip_meta(trip_id)
-            if not meta:
-                tg_edit_text(
-                    chat_id, msg_id, f"❌ Ride #{trip_id} not found.", clear_keyboard=True)
-                return {"statusCode": 200, "body": "ok"}
-
-            if meta.get("status") == "accepted":
-                taken_by = meta.get("driver_name", "another driver")
-                try:
-                    tg_edit_text(
-                        chat_id, msg_id, f"ℹ️ Ride #{trip_id} already accepted by {taken_by}.", clear_keyboard=True)
-                except Exception:
-                    tg_edit_reply_markup_clear(chat_id, msg_id)
-                return {"statusCode": 200, "body": "ok"}
-
-            prof = _DRIVER_PROFILES.get(str(driver_id), {})
-            dname = prof.get("name", "Driver")
-            dcar = prof.get("car",  "Car")
-            set_trip_driver(trip_id, driver_id, dname, dcar)
-            set_trip_status(trip_id, meta["user_id"], "accepted")
-
-            try:
-                tg_edit_text(
-                    chat_id, msg_id, f"✅ Ride #{trip_id} accepted.", clear_keyboard=True)
-            except Exception:
-                tg_edit_reply_markup_clear(chat_id, msg_id)
-
-            tg_send_message(
-                meta["user_chat_id"],
-                f"✅ Your request #{trip_id} has been confirmed.\nDriver: {dname}\nCar: {dcar}\n"
-                f"Driver will contact you via SMS."
-            )
-            tg_send_message(chat_id, f"✅ Client notified for ride #{trip_id}.")
-            return {"statusCode": 200, "body": "ok"}
-
-        if data.startswith("decline:"):
-            try:
-                _, trip_id, driver_id = data.split(":")
-            except ValueError:
-                return {"statusCode": 200, "body": "ok"}
-
-            meta = get_trip_meta(trip_id)
-            try:
-                tg_edit_text(
-                    chat_id, msg_id, f"❌ Ride #{trip_id} declined.", clear_keyboard=True)
-            except Exception:
-                tg_edit_reply_markup_clear(chat_id, msg_id)
-
-            if meta and meta.get("status") == "pending":
-                set_trip_status(trip_id, meta["user_id"], "declined")
-                tg_send_message(
-                    meta["user_chat_id"], f"❌ Sorry, your request #{trip_id} was declined.")
-            return {"statusCode": 200, "body": "ok"}
+        op, _, rest = data.partition(":")
+        h = CALLBACK_HANDLERS.get(op)
+        return h(chat_id, msg_id, rest) if h else _OK
 
-    return {"statusCode": 200, "body": "ok"}
+    return _OK
 
 # ======================================================
 # Helper after time selection
@@ -862,7 +1291,7 @@ def lambda_handler(event, context):
 
 
 def after_when_ask_phone_or_profile(chat_id, user_id, trip_id):
-    prof = get_profile(user_id) or {}
+    prof = get_profile_cached(user_id) or {}
     saved_phone = prof.get("phone")
     if saved_phone:
         tg_send_message(
@@ -876,4 +1305,4 @@ def after_when_ask_phone_or_profile(chat_id, user_id, trip_id):
     else:
         tg_send_message(chat_id, "Time saved. Please enter your phone number.")
         put_session(user_id, f"await_phone:{trip_id}", {})
-    return {"statusCode": 200, "body": "ok"}
+    return _OK
@@ -57,6 +57,17 @@ resource "aws_dynamodb_table" "trips" {
     projection_type = "ALL"
   }
 
+  # -----------------------------
+  # Time to live
+  # -----------------------------
+  # Session items (sk = SESSION) and geocode cache items (pk = GEO#...)
+  # carry a "ttl" epoch; DynamoDB deletes them for free once expired.
+  # Items without the attribute (trips, profiles) never expire.
+  ttl {
+    attribute_name = "ttl"
+    enabled        = true
+  }
+
   # -----------------------------
   # Tags (for billing and organization)
   # -----------------------------
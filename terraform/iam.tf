@@ -70,6 +70,7 @@ data "aws_iam_policy_document" "lambda_policy_doc" {
     effect  = "Allow"
     actions = [
       "ssm:GetParameter",        # read a single parameter
+      "ssm:GetParameters",       # read several parameters in one call
       "ssm:GetParametersByPath"  # read multiple parameters under /ridebot/*
     ]
     resources = [
@@ -77,6 +78,22 @@ data "aws_iam_policy_document" "lambda_policy_doc" {
     ]
   }
 
+  # ------------------------------------------------------
+  # SQS (Telegram update queue)
+  # Webhook Lambda sends updates; worker Lambda consumes them
+  # ------------------------------------------------------
+  statement {
+    sid     = "SQSUpdatesQueue"
+    effect  = "Allow"
+    actions = [
+      "sqs:SendMessage",       # webhook enqueues updates
+      "sqs:ReceiveMessage",    # worker event source mapping
+      "sqs:DeleteMessage",
+      "sqs:GetQueueAttributes"
+    ]
+    resources = [aws_sqs_queue.updates.arn]
+  }
+
   # ------------------------------------------------------
   # KMS (Key Management Service)
   # Needed because SSM uses KMS to encrypt SecureString parameters
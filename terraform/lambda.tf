@@ -9,6 +9,33 @@ data "archive_file" "lambda_zip" {
   output_path = "${path.module}/../lambda_src.zip"    # output .zip file path
 }
 
+# ------------------------------------------------------
+# Environment shared by the webhook and worker functions
+# These are used in app.py to access resources and fare rules.
+# ------------------------------------------------------
+locals {
+  lambda_env = {
+    # DynamoDB table name
+    TABLE_NAME = aws_dynamodb_table.trips.name
+
+    # Amazon Location resources
+    PLACE_INDEX_NAME      = aws_location_place_index.places.index_name
+    ROUTE_CALCULATOR_NAME = aws_location_route_calculator.routes.calculator_name
+
+    # Secrets stored in SSM Parameter Store
+    SSM_TOKEN_PARAM  = data.aws_ssm_parameter.telegram_token.name   # Telegram bot token
+    SSM_DRIVER_PARAM = data.aws_ssm_parameter.driver_chat_id.name   # Driver chat ID(s)
+
+    # Fare calculation rules (editable without redeploying Lambda code)
+    FARE_BASE     = "3.0"   # base fare ($)
+    FARE_PER_MILE = "1.5"   # cost per mile
+    FARE_PER_MIN  = "0.35"  # cost per minute
+    FARE_FEE      = "1.0"   # service/booking fee
+    FARE_SURGE    = "1.0"   # surge multiplier
+    FARE_MINIMUM  = "8.0"   # minimum fare ($)
+  }
+}
+
 # ------------------------------------------------------
 # AWS Lambda Function
 # Handles Telegram webhook requests via API Gateway.
@@ -36,33 +63,62 @@ resource "aws_lambda_function" "handler" {
 
   # ------------------------------------------------------
   # Environment variables passed to Lambda
-  # These are used in app.py to access resources and fare rules.
+  # Shared settings come from local.lambda_env (see top of file);
+  # only the webhook gets the queue URL.
   # ------------------------------------------------------
   environment {
-    variables = {
-      # DynamoDB table name
-      TABLE_NAME = aws_dynamodb_table.trips.name
-
-      # Amazon Location resources
-      PLACE_INDEX_NAME      = aws_location_place_index.places.index_name
-      ROUTE_CALCULATOR_NAME = aws_location_route_calculator.routes.calculator_name
-
-      # Secrets stored in SSM Parameter Store
-      SSM_TOKEN_PARAM  = data.aws_ssm_parameter.telegram_token.name   # Telegram bot token
-      SSM_DRIVER_PARAM = data.aws_ssm_parameter.driver_chat_id.name   # Driver chat ID(s)
-
-      # Fare calculation rules (editable without redeploying Lambda code)
-      FARE_BASE     = "3.0"   # base fare ($)
-      FARE_PER_MILE = "1.5"   # cost per mile
-      FARE_PER_MIN  = "0.35"  # cost per minute
-      FARE_FEE      = "1.0"   # service/booking fee
-      FARE_SURGE    = "1.0"   # surge multiplier
-      FARE_MINIMUM  = "8.0"   # minimum fare ($)
-    }
+    variables = merge(local.lambda_env, {
+      # Webhook only enqueues updates here; the worker Lambda processes them
+      UPDATES_QUEUE_URL = aws_sqs_queue.updates.url
+    })
   }
 
   # Tags (for cost allocation and organization)
   tags = {
     Project = var.project_name
   }
-}
\ No newline at end of file
+}
+
+# ------------------------------------------------------
+# Worker Lambda
+# Same code package, different entrypoint: consumes Telegram
+# updates from SQS and does the actual processing.
+# ------------------------------------------------------
+resource "aws_lambda_function" "worker" {
+  function_name = "${var.project_name}-worker"
+  role          = aws_iam_role.lambda_role.arn
+
+  # Entrypoint: app.py → function worker_handler(event, context)
+  handler = "app.worker_handler"
+  runtime = "python3.12"
+
+  filename         = data.archive_file.lambda_zip.output_path
+  source_code_hash = data.archive_file.lambda_zip.output_base64sha256
+
+  # Geocoding + routing + Telegram fan-out can take longer than the webhook
+  timeout = 30
+
+  # Same settings as the webhook, minus the queue URL
+  environment {
+    variables = local.lambda_env
+  }
+
+  tags = {
+    Project = var.project_name
+  }
+}
+
+# ------------------------------------------------------
+# SQS → worker Lambda trigger
+# Partial batch responses let the worker retry only the failed
+# update (and the ones queued behind it in the same batch).
+# ------------------------------------------------------
+resource "aws_lambda_event_source_mapping" "updates" {
+  event_source_arn        = aws_sqs_queue.updates.arn
+  function_name           = aws_lambda_function.worker.arn
+  batch_size              = 10
+  function_response_types = ["ReportBatchItemFailures"]
+
+  # CreateEventSourceMapping checks that the role can already read the queue
+  depends_on = [aws_iam_role_policy_attachment.attach]
+}
@@ -15,6 +15,13 @@ resource "aws_location_place_index" "places" {
 
   # "Here" is the default commercial map data provider supported by AWS Location
   data_source = "Here"
+
+  # "Storage" is required because the Lambda caches geocode results in
+  # DynamoDB (GEO# items, 30-day TTL); the default "SingleUse" forbids storing
+  # results. Storage requests are billed at a higher per-request rate.
+  data_source_configuration {
+    intended_use = "Storage"
+  }
 }
 
 # ------------------------------------------------------
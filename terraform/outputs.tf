@@ -38,4 +38,9 @@ output "route_calculator_name" {
 # Equivalent to webhook_url, but ensures base URL has no trailing slash
 output "current_telegram_webhook" {
   value = "${trimsuffix(aws_apigatewayv2_stage.prod.invoke_url, "/")}/telegram/webhook"
-}
\ No newline at end of file
+}
+
+# SQS FIFO queue that buffers Telegram updates for the worker Lambda
+output "updates_queue_url" {
+  value = aws_sqs_queue.updates.url
+}
@@ -0,0 +1,42 @@
+# ------------------------------------------------------
+# SQS queue for Telegram updates
+# Purpose: the webhook Lambda only enqueues the update and answers 200
+# right away; the worker Lambda does the slow work (SSM, Location,
+# DynamoDB, Telegram replies) so Telegram never sees a slow webhook.
+# ------------------------------------------------------
+
+# Main queue (FIFO)
+# - MessageGroupId = Telegram sender id → updates from one chat stay in order
+# - MessageDeduplicationId = update_id → Telegram retries are dropped
+resource "aws_sqs_queue" "updates" {
+  name                        = "${var.project_name}-updates.fifo"
+  fifo_queue                  = true
+  content_based_deduplication = false
+
+  # Must be >= worker Lambda timeout (AWS recommends 6x)
+  visibility_timeout_seconds = 180
+
+  # Updates older than a day are useless to the user
+  message_retention_seconds = 86400
+
+  # After 3 failed attempts the update goes to the dead-letter queue
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.updates_dlq.arn
+    maxReceiveCount     = 3
+  })
+
+  tags = {
+    Project = var.project_name
+  }
+}
+
+# Dead-letter queue (must also be FIFO)
+resource "aws_sqs_queue" "updates_dlq" {
+  name                      = "${var.project_name}-updates-dlq.fifo"
+  fifo_queue                = true
+  message_retention_seconds = 1209600 # 14 days, for debugging
+
+  tags = {
+    Project = var.project_name
+  }
+}
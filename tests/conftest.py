@@ -0,0 +1,34 @@
+import os
+import sys
+
+import boto3
+import pytest
+from moto import mock_aws
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda_src"))
+
+# Module-level config read by app.py at import time. UPDATES_QUEUE_URL keeps
+# the import from loading SSM secrets.
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("TABLE_NAME", "ridebot-test")
+os.environ.setdefault("PLACE_INDEX_NAME", "ridebot-test-places")
+os.environ.setdefault("ROUTE_CALCULATOR_NAME", "ridebot-test-routes")
+os.environ.setdefault("UPDATES_QUEUE_URL", "https://sqs.invalid/queue.fifo")
+
+
+@pytest.fixture
+def app():
+    """app module backed by a fresh moto DynamoDB table (same pk/sk schema)."""
+    with mock_aws():
+        boto3.client("dynamodb").create_table(
+            TableName=os.environ["TABLE_NAME"],
+            KeySchema=[{"AttributeName": "pk", "KeyType": "HASH"},
+                       {"AttributeName": "sk", "KeyType": "RANGE"}],
+            AttributeDefinitions=[{"AttributeName": "pk", "AttributeType": "S"},
+                                  {"AttributeName": "sk", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        import app as app_module
+        yield app_module
@@ -0,0 +1,77 @@
+"""Round-trips for the write paths that send pre-marshalled items."""
+
+
+def _item(app, pk, sk):
+    return app.table.get_item(Key={"pk": pk, "sk": sk}).get("Item")
+
+
+def test_set_trip_status_updates_both_rows(app):
+    app.table.put_item(Item={"pk": "TRIP#t1", "sk": "META", "status": "await_when"})
+    app.table.put_item(Item={"pk": "USER#7", "sk": "TRIP#t1", "status": "await_when"})
+
+    app.set_trip_status("t1", 7, "declined")
+
+    assert _item(app, "TRIP#t1", "META")["status"] == "declined"
+    assert _item(app, "USER#7", "TRIP#t1")["status"] == "declined"
+
+
+def test_save_trip_writes_user_and_meta_rows(app):
+    dep = {"label": "A St", "lon": -87.6, "lat": 41.8}
+    dest = {"label": "B Ave", "lon": -87.7, "lat": 41.9}
+
+    tid = app.save_trip(7, dep, dest, 3.2, 11.0, 12.5)
+
+    meta = _item(app, f"TRIP#{tid}", "META")
+    assert meta["user_id"] == "7"
+    assert meta["dep_label"] == "A St"
+    assert meta["fare_label"] == "$12.50"
+    assert meta["status"] == "await_when"
+    row = _item(app, "USER#7", f"TRIP#{tid}")
+    assert row["dest"]["label"] == "B Ave"
+    assert float(row["dest"]["lat"]) == 41.9
+
+
+def test_put_session_round_trips(app):
+    app.put_session(7, "await_dropoff", {"pickup_raw": "A St"})
+
+    session = app.get_session(7)
+    assert session["state"] == "await_dropoff"
+    assert session["data"]["pickup_raw"] == "A St"
+    assert session["ttl"] > app.now_ts()
+
+
+class _Location:
+    """Stands in for the Amazon Location client; counts searches."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def search_place_index_for_text(self, **kwargs):
+        self.calls += 1
+        return {"Results": [{"Place": {"Label": "1 Main St, Chicago, IL",
+                                       "Geometry": {"Point": [-87.63, 41.88]}}}]}
+
+
+def test_geocode_second_cold_lookup_is_served_from_dynamodb(app, monkeypatch):
+    loc = _Location()
+    monkeypatch.setitem(app._CLIENTS, "location", loc)
+    app._geocode_cached.cache_clear()
+
+    first = app.geocode_once("1 Main St")
+    app._geocode_cached.cache_clear()  # a different (cold) container
+    second = app.geocode_once("1 Main St")
+
+    assert loc.calls == 1
+    assert first == second == {"label": "1 Main St, Chicago, IL",
+                               "lon": -87.63, "lat": 41.88}
+    geo = _item(app, "GEO#" + app._norm_addr("1 Main St"), "GEO")
+    assert geo["ttl"] > app.now_ts()
+
+
+def test_set_profile_phone_round_trips_and_drops_cache(app):
+    app._PROFILE_CACHE.clear()
+    assert app.get_profile_cached(7) is None
+
+    app._EXEC.submit(app.set_profile_phone, 7, "+18505551234").result()
+
+    assert app.get_profile_cached(7)["phone"] == "+18505551234"
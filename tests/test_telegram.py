@@ -0,0 +1,42 @@
+import pytest
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+
+
+class _Resp:
+    status = 200
+    data = b'{"ok": true}'
+
+
+class _Pool:
+    """Stands in for _TG_POOL: raises the queued errors, then answers 200."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def request(self, *args, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return _Resp()
+
+
+@pytest.fixture
+def tg(app, monkeypatch):
+    monkeypatch.setattr(app, "_TELEGRAM_TOKEN", "test-token")
+    return app
+
+
+def test_stale_socket_is_resent_once(tg, monkeypatch):
+    pool = _Pool(ProtocolError("Connection aborted.", ConnectionResetError()))
+    monkeypatch.setattr(tg, "_TG_POOL", pool)
+    assert tg.tg_request("sendMessage", {"chat_id": "1", "text": "hi"}) == {"ok": True}
+    assert pool.calls == 2
+
+
+def test_read_timeout_is_not_resent(tg, monkeypatch):
+    pool = _Pool(ReadTimeoutError(None, "/", "timed out"))
+    monkeypatch.setattr(tg, "_TG_POOL", pool)
+    with pytest.raises(ReadTimeoutError):
+        tg.tg_request("sendMessage", {"chat_id": "1", "text": "hi"})
+    assert pool.calls == 1